@@ -1,5 +1,7 @@
 import json
+import os
 import random
+from itertools import accumulate
 from pathlib import Path
 
 
@@ -8,6 +10,8 @@ from pathlib import Path
 # ============================================================
 FIRST_FRAMES = "../dataset/first_frames"
 OUTPUT_JSON = "../dataset/generated_prompts.json"
+# extract_first_frames.py writes .jpg, or links the original .png with --copy_mode
+FRAME_EXTS = {".jpg", ".png"}
 
 PREFIX_PROMPT = (
     "A realistic continuation of the reference scene. "
@@ -49,20 +53,25 @@ COMPLEX_PATHS = [
 ]
 
 
-def random_motion_piece():
-    """Return a single natural-language motion."""
-    group = random.choice(["T", "R", "C"])
-    if group == "T":
-        return random.choice(TRANSLATIONS)
-    if group == "R":
-        return random.choice(ROTATIONS)
-    if group == "C":
-        return random.choice(COMPLEX_PATHS)
+MOTION_GROUPS = (TRANSLATIONS, ROTATIONS, COMPLEX_PATHS)
 
+# Flat pool + cumulative weights: one draw per piece, while each group keeps a
+# total probability of 1/3 (uniform within the group), as with group-then-item.
+_ALL_MOTIONS = tuple(m for group in MOTION_GROUPS for m in group)
+_CUM_WEIGHTS = tuple(accumulate(
+    1 / (len(MOTION_GROUPS) * len(group)) for group in MOTION_GROUPS for _ in group
+))
 
-def generate_multi_stage_motion():
+
+def random_motion_pieces(k, rng=random):
+    """Return k natural-language motions, drawn with replacement in one call."""
+    return rng.choices(_ALL_MOTIONS, cum_weights=_CUM_WEIGHTS, k=k)
+
+
+def generate_multi_stage_motion(rng=random):
     """Generate 2–3 segments joined by natural connectors."""
-    pieces = [random_motion_piece() for _ in range(random.choice([2, 3]))]
+    n = 2 + (rng.random() < 0.5)
+    pieces = random_motion_pieces(n, rng)
 
     if len(pieces) == 1:
         return pieces[0]
@@ -76,27 +85,40 @@ def generate_multi_stage_motion():
 # MAIN
 # ============================================================
 def main():
-    frames = sorted(Path(FIRST_FRAMES).glob("*.jpg"))
+    # scandir's DirEntry already carries the file type, so no extra stat per image
+    with os.scandir(FIRST_FRAMES) as it:
+        frames = sorted(
+            Path(e.path) for e in it
+            if os.path.splitext(e.name)[1] in FRAME_EXTS and e.is_file()
+        )
     print(f"Found {len(frames)} images.")
 
-    result = {}
+    # One local generator for the whole run instead of the module-level instance
+    rng = random.Random()
 
-    for img_path in frames:
-        name = img_path.stem
+    # 逐条写出 JSON 对象，避免先在内存里拼出完整 dict 再整体 dump
+    with open(OUTPUT_JSON, "w") as f:
+        f.write("{\n")
 
-        camera_motion = generate_multi_stage_motion()
-        text_prompt = PREFIX_PROMPT + f" Camera motion: {camera_motion}."
+        for i, img_path in enumerate(frames):
+            name = img_path.stem
 
-        result[name] = {
-            "image_prompt": str(img_path),
-            "camera_motion": camera_motion,
-            "text_prompt": text_prompt,
-        }
+            camera_motion = generate_multi_stage_motion(rng)
+            text_prompt = PREFIX_PROMPT + f" Camera motion: {camera_motion}."
 
-        print(f"[{name}]  {camera_motion}")
+            entry = {
+                "image_prompt": str(img_path),
+                "camera_motion": camera_motion,
+                "text_prompt": text_prompt,
+            }
 
-    with open(OUTPUT_JSON, "w") as f:
-        json.dump(result, f, indent=2)
+            if i:
+                f.write(",\n")
+            f.write(json.dumps(name) + ": " + json.dumps(entry, separators=(",", ":")))
+
+            print(f"[{name}]  {camera_motion}")
+
+        f.write("\n}\n")
 
     print("\n=========== DONE ===========")
     print(f"Saved prompts → {OUTPUT_JSON}\n")
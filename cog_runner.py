@@ -0,0 +1,742 @@
+"""
+CogVideoX I2V 批量生成的共享实现。
+
+i2v_cog15.py / i2v_cogx.py 只保留各自的模型与路径配置，通过 main(**config) 调用这里的同一份逻辑：
+读取 generated_prompts.json，为每个 Group 生成 K 个视频，结果记录在 OUTPUT_JSON 中 (支持断点续传与多 GPU)。
+"""
+import os
+
+# 必须在 import torch 之前设置：可扩展的显存段减少 VAE 解码时激活形状变化带来的碎片
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True")
+
+import json
+from pathlib import Path
+import numpy as np
+import torch
+from diffusers import CogVideoXImageToVideoPipeline, CogVideoXDDIMScheduler
+from PIL import Image, ImageOps
+import random
+import sys
+import copy
+import argparse
+import subprocess
+import imageio_ffmpeg
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Sequence
+
+# 可选依赖：orjson 序列化更快且直接返回 bytes，未安装时退回标准库 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson.JSONDecodeError 是 json.JSONDecodeError 的子类，两种实现都可以同样地捕获
+json_loads = orjson.loads if orjson is not None else json.loads
+
+# ----------------------------
+# PATHS & CONFIGURATION
+# 以下为默认值，入口脚本通过 main(**config) / configure(**config) 覆盖
+# ----------------------------
+MODEL_ID = "THUDM/CogVideoX-5B-I2V"
+NUM_FRAMES = 49     # CogVideoX-5B: 49 帧；CogVideoX1.5-5B: 81 帧
+PROMPT_JSON = "../dataset/generated_prompts.json"
+OUTPUT_DIR = "../dataset/videos"  # 视频输出根目录
+OUTPUT_JSON = "../dataset/cog_generation_results.json"  # JSON 结果文件
+
+# 配置
+K = 3               # 每个 Prompt 目标生成 K 个视频
+RESUME = True       # 启用断点续传
+MAX_GROUPS = None   
+GPU_ID = None       # 单 worker 时通过 CUDA_VISIBLE_DEVICES 指定的 GPU；None 表示依赖 Bash 环境变量
+COMPILE_TRANSFORMER = True  # 用 torch.compile 编译 DiT (首个 Group 需额外编译时间)
+DECODE_DEVICE = None        # VAE 解码所在设备，如 "cuda:1" 或 "cpu"；None 表示与 DiT 同卡
+QUANTIZE_TRANSFORMER = False  # 用 torchao 对 DiT 做 weight-only 量化："int8" (True 同 "int8") 或 "fp8" (需 H100/4090 等 fp8 硬件)；需额外安装 torchao
+NUM_INFERENCE_STEPS = 50     # 去噪步数；trailing 间隔下可尝试 25 步 (DiT 计算量减半，需检查画质)
+GUIDANCE_SCALE = 6           # CFG 强度；> 1 时每步 DiT 要同时算 cond / uncond 两份 batch
+BATCH_GROUPS = 1             # 每次 pipe 调用合并的 Group 数 (batch = 各 Group 缺失视频数之和，受显存限制)
+SEED = None                  # 设为整数时，整个运行中各视频的随机 seed 可复现
+FPS = 8                      # 输出视频帧率
+FFMPEG_PRESET = "ultrafast"  # libx264 编码速度预设；更慢的预设文件更小，但编码耗时更长
+
+_CONFIG_NAMES = {name for name in dir() if name.isupper()}
+
+def configure(**overrides):
+    """用入口脚本的配置覆盖上面的模块级配置；只接受已有的配置项，拼错名字时直接报错"""
+    unknown = set(overrides) - _CONFIG_NAMES
+    if unknown:
+        raise KeyError(f"Unknown config option(s): {sorted(unknown)}")
+    globals().update(overrides)
+
+# --- 辅助函数 ---
+def ensure_dir(d):
+    Path(d).mkdir(parents=True, exist_ok=True)
+
+def results_shard_path(rank: int) -> str:
+    """每个 worker 自己的追加式结果分片 (JSONL，一行一个 Group 的完整记录)"""
+    return f"{OUTPUT_JSON}.rank{rank}.jsonl"
+
+def list_results_shards() -> List[Path]:
+    output_json = Path(OUTPUT_JSON)
+    return sorted(output_json.parent.glob(output_json.name + ".rank*.jsonl"))
+
+def group_to_json(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """内存中的 Group Entry → 写盘格式 (videos 展开为按 video_name 排序的列表)"""
+    videos = entry["videos"]
+    return {**entry, "videos": [videos[name] for name in sorted(videos)]}
+
+def load_results_json(backup_unreadable: bool = False) -> Dict[int, Dict[str, Any]]:
+    """
+    安全加载已合并的 JSON 文件及所有 worker 的 JSONL 分片 (分片中较新的记录覆盖旧的)，
+    返回以 group_id 为键的 {group_id: group_entry}。
+    backup_unreadable=True 时把无法解析的 OUTPUT_JSON 改名为 .bak 保留下来，避免随后被覆盖而丢失。
+    """
+    groups = {}
+
+    def add_group(g):
+        # 内存中 videos 为 {video_name: video_entry}，写入时再展开成有序列表
+        g["videos"] = {v["video_name"]: v for v in g.get("videos", []) if v.get("video_name")}
+        groups[g["group_id"]] = g
+
+    if Path(OUTPUT_JSON).exists():
+        try:
+            with open(OUTPUT_JSON, 'rb') as f:
+                raw = json_loads(f.read())
+            for g in raw.get("groups", []):
+                add_group(g)
+        except (IOError, json.JSONDecodeError) as e:
+            print(f"[WARN] Could not load {OUTPUT_JSON}, starting fresh. Error: {e}")
+            if backup_unreadable:
+                backup_path = OUTPUT_JSON + ".bak"
+                os.replace(OUTPUT_JSON, backup_path)
+                print(f"[WARN] Moved the unreadable {OUTPUT_JSON} to {backup_path}")
+
+    for shard in list_results_shards():
+        with open(shard, 'rb') as f:
+            for line in f:
+                try:
+                    add_group(json_loads(line))
+                except json.JSONDecodeError:
+                    # 进程中断时可能留下写了一半的行
+                    print(f"[WARN] Skipping malformed line in {shard}")
+    return groups
+
+def append_results_shard(updated: Dict[int, Dict[str, Any]], shard_path: str):
+    """
+    把本次更新过的 Group (完整记录) 追加到本 worker 自己的 JSONL 分片。
+    各 worker 写各自的文件，不需要加锁，也不必每次重写整个 JSON。
+    """
+    try:
+        with open(shard_path, 'ab') as f:
+            for gid in sorted(updated):
+                entry = group_to_json(updated[gid])
+                if orjson is not None:
+                    f.write(orjson.dumps(entry) + b"\n")
+                else:
+                    f.write((json.dumps(entry) + "\n").encode())
+    except Exception as e:
+        print(f"[ERROR] Failed to append results to {shard_path}: {e}")
+
+def merge_results():
+    """
+    把已有的 JSON 与所有分片合并，按 group_id 排序后原子写成最终的 OUTPUT_JSON，再删除已合并的分片。
+    必须在所有 worker 结束之后运行。
+    """
+    shards = list_results_shards()
+    # 合并结果会覆盖 OUTPUT_JSON，无法解析的旧文件先移到一旁
+    results = load_results_json(backup_unreadable=True)
+    groups = [group_to_json(results[gid]) for gid in sorted(results)]
+
+    if orjson is not None:
+        data = orjson.dumps({"groups": groups}, option=orjson.OPT_INDENT_2)
+    else:
+        data = json.dumps({"groups": groups}, indent=2).encode()
+
+    temp_file = OUTPUT_JSON + ".tmp"
+    with open(temp_file, 'wb') as f:
+        f.write(data)
+    os.replace(temp_file, OUTPUT_JSON)
+
+    for shard in shards:
+        shard.unlink()
+    print(f"[JSON] Merged {len(shards)} shard(s) → {OUTPUT_JSON} ({len(groups)} groups)")
+
+def skip(path: Path) -> bool:
+    """检查文件是否存在"""
+    return path.exists()
+
+def quantize_transformer(pipe, mode: str):
+    """
+    用 torchao 对 DiT 的 Linear 层做 weight-only 量化 (可选依赖，仅在开启时导入)。
+    权重以 int8 / fp8 存储，每个去噪步从显存读取的权重字节减半；norm 与注意力 softmax 仍为 bf16。
+    """
+    from torchao.quantization import quantize_, int8_weight_only, float8_weight_only
+    methods = {"int8": int8_weight_only, "fp8": float8_weight_only}
+    if mode not in methods:
+        raise ValueError(f"QUANTIZE_TRANSFORMER must be one of {sorted(methods)}, got {mode!r}")
+    quantize_(pipe.transformer, methods[mode]())
+    print(f"[INFO] Transformer weights quantized to {mode}")
+
+# 编译后 transformer 使用的固定 batch 大小 (视频数)；None 表示未编译，各 batch 按实际大小运行
+_static_batch_size: Optional[int] = None
+
+def warmup_compiled_transformer(pipe, device) -> bool:
+    """
+    用 K * BATCH_GROUPS 张空白图像跑一步去噪 (不解码)，让 torch.compile 在进入 Group 循环前
+    按实际生产的 batch 大小完成编译并录制 CUDA Graph；之后 generate_videos 把每个 batch 补齐到这个大小。
+    编译失败 (如节点缺少 C 编译器或 Python 头文件) 时退回未编译的 transformer，返回 False。
+    """
+    global _static_batch_size
+    height, width = model_input_size(pipe)
+    batch_size = K * BATCH_GROUPS
+    try:
+        with torch.inference_mode():
+            pipe(
+                prompt=[""] * batch_size,
+                image=torch.zeros(batch_size, 3, height, width, device=device),
+                num_videos_per_prompt=1,
+                num_inference_steps=1,
+                num_frames=NUM_FRAMES,
+                guidance_scale=GUIDANCE_SCALE,
+                output_type="latent",
+            )
+        _static_batch_size = batch_size
+        return True
+    except Exception as e:
+        print(f"[WARN] torch.compile warm-up failed, falling back to the eager transformer: {e}")
+        pipe.transformer = pipe.transformer._orig_mod
+        torch.cuda.empty_cache()
+        return False
+
+def offload_vae_decode(pipe, decode_device):
+    """
+    把 VAE 解码拆成单独的阶段放到 decode_device 上，DiT 所在的卡不再承担解码的峰值显存。
+    pipe.vae 仍留在原设备上负责编码条件图像，解码使用它的一份拷贝。
+    """
+    decode_vae = copy.deepcopy(pipe.vae).to(decode_device)
+
+    def decode_latents(latents):
+        # 与 CogVideoXImageToVideoPipeline.decode_latents 相同，只是换成解码设备上的 VAE
+        # 拷到 CPU 时必须同步：异步 D2H 拷贝完成前 CPU 上的 VAE 就会读取 latents
+        latents = latents.to(decode_vae.device, non_blocking=decode_vae.device.type == "cuda")
+        latents = latents.permute(0, 2, 1, 3, 4) / decode_vae.config.scaling_factor
+        return decode_vae.decode(latents).sample
+
+    pipe.decode_latents = decode_latents
+
+def cache_image_encode(pipe):
+    """
+    pipeline 在 prepare_latents 中为 batch 的每一行各调用一次 vae.encode，而同一 Group 的 K 行条件图完全相同。
+    缓存上一次的输入及其编码结果 (潜变量的高斯分布)，输入相同时直接复用；
+    每个视频仍用各自的 generator 从分布中采样，结果与不缓存时一致。
+    """
+    encode = pipe.vae.encode
+    last = {}
+
+    def cached_encode(x, *args, **kwargs):
+        prev = last.get("input")
+        if prev is not None and prev.shape == x.shape and torch.equal(prev, x):
+            return last["output"]
+        output = encode(x, *args, **kwargs)
+        last["input"], last["output"] = x, output
+        return output
+
+    pipe.vae.encode = cached_encode
+
+def model_input_size(pipe):
+    """pipeline 默认的输入分辨率 (height, width)"""
+    height = pipe.transformer.config.sample_height * pipe.vae_scale_factor_spatial
+    width = pipe.transformer.config.sample_width * pipe.vae_scale_factor_spatial
+    return height, width
+
+def load_image_tensor(img_path: str, height: int, width: int, device: torch.device, copy_stream=None):
+    """
+    读图并缩放到模型输入尺寸 (与 pipeline 的 PIL 分支一样使用 Lanczos)，得到 [1, 3, H, W] 的 uint8 张量，
+    经 pinned 内存在 copy_stream 上以 non_blocking 方式拷到 device (数据量是 float32 的 1/4)，再归一化到 [0, 1]。
+    在后台线程中预取时，H2D 拷贝与默认 stream 上正在进行的去噪计算重叠。
+
+    返回 (image, ready)；ready 为 copy_stream 上的 CUDA Event (CPU 上为 None)，使用前交给 wait_image_ready。
+    pipeline 收到已在 device 上的张量后不会再做一次阻塞的 H2D 拷贝。
+    """
+    image = Image.open(img_path)
+    # JPEG 在解码时直接按 1/2、1/4、1/8 在 DCT 域缩小 (仍不小于目标尺寸)，其他格式忽略此提示。
+    # 用正方形请求，EXIF 旋转交换宽高后也不会小于目标尺寸
+    side = max(width, height)
+    image.draft("RGB", (side, side))
+    # 与 diffusers.utils.load_image 相同：按 EXIF 方向摆正后转 RGB
+    image = ImageOps.exif_transpose(image).convert("RGB")
+    image = image.resize((width, height), resample=Image.LANCZOS)
+    tensor = torch.from_numpy(np.array(image)).permute(2, 0, 1).unsqueeze(0)
+
+    if copy_stream is None:
+        return tensor.to(device).float().div_(255), None
+
+    with torch.cuda.stream(copy_stream):
+        image = tensor.pin_memory().to(device, non_blocking=True).float().div_(255)
+        ready = torch.cuda.Event()
+        ready.record(copy_stream)
+    return image, ready
+
+def wait_image_ready(image: torch.Tensor, ready) -> torch.Tensor:
+    """让当前 stream 等待 copy stream 上的拷贝完成，并告知缓存分配器这块显存之后在当前 stream 上使用"""
+    if ready is not None:
+        stream = torch.cuda.current_stream(image.device)
+        stream.wait_event(ready)
+        image.record_stream(stream)
+    return image
+
+# 空负向 prompt 的 T5 编码结果 [1, seq, dim]，整个运行中不变，只需编码一次
+_negative_prompt_embeds: Optional[torch.Tensor] = None
+
+def encode_text_prompt(pipe, text_prompts: List[str], device):
+    """
+    对一个 batch 中各 Group 的 text_prompt 只跑一次 T5，返回 (prompt_embeds, negative_prompt_embeds)，
+    每个 prompt 一行；批量生成及 OOM 回退时的逐个生成都复用这份结果。
+    负向 prompt 固定为空串 (与 pipeline 默认一致)，首次编码后缓存，之后只做 expand。
+    """
+    global _negative_prompt_embeds
+    with torch.inference_mode():
+        prompt_embeds, _ = pipe.encode_prompt(
+            prompt=text_prompts,
+            do_classifier_free_guidance=False,
+            num_videos_per_prompt=1,
+            device=device,
+        )
+        if GUIDANCE_SCALE <= 1:
+            return prompt_embeds, None
+        if _negative_prompt_embeds is None:
+            _negative_prompt_embeds, _ = pipe.encode_prompt(
+                prompt=[""],
+                do_classifier_free_guidance=False,
+                num_videos_per_prompt=1,
+                device=device,
+            )
+    return prompt_embeds, _negative_prompt_embeds.expand(len(text_prompts), -1, -1)
+
+# 复用的 torch.Generator，只重新设置 seed 而不是每个视频新建一个
+_generator_pool: List[torch.Generator] = []
+
+def get_generators(n: int, device) -> List[torch.Generator]:
+    """返回 n 个各自重新播种 (独立随机 seed) 的 generator"""
+    while len(_generator_pool) < n:
+        _generator_pool.append(torch.Generator(device=device))
+    generators = _generator_pool[:n]
+    for generator in generators:
+        generator.manual_seed(random.randint(0, 2**32 - 1))
+    return generators
+
+def generate_videos(pipe, prompt_embeds, negative_prompt_embeds, images, generators) -> Sequence[Optional[np.ndarray]]:
+    """
+    一次 pipe 调用生成 len(generators) 个视频，第 i 个视频使用 prompt_embeds[i] / images[i] / generators[i]，
+    让 DiT 在每个去噪步处理整个 batch (可来自同一 Group 的 K 个视频，也可跨多个 Group)。
+    每个视频为 [F, H, W, 3] 的 uint8 数组；显存不足 (OOM) 时退回逐个生成，失败的位置返回 None。
+    """
+    # inference_mode 比 pipeline 自带的 no_grad 更彻底：不再维护 version counter / view 追踪
+    @torch.inference_mode()
+    def run(rows, pad_to=None):
+        num_videos = len(rows)
+        batch_generators = [generators[i] for i in rows]
+        if pad_to is not None and num_videos < pad_to:
+            # 不完整的 batch 重复最后一行补齐到编译时的大小，复用同一个 CUDA Graph 而不是重新编译；
+            # 补齐的行用单独的 generator，不影响真实视频的随机数，输出直接丢弃
+            padding_generator = torch.Generator(device=generators[0].device)
+            rows = rows + [rows[-1]] * (pad_to - num_videos)
+            batch_generators += [padding_generator] * (pad_to - num_videos)
+        # 传入 embeds 时 pipeline 以 embeds 的行数作为 batch
+        frames = pipe(
+            prompt_embeds=prompt_embeds[rows],
+            negative_prompt_embeds=negative_prompt_embeds[rows] if negative_prompt_embeds is not None else None,
+            # 每个视频对应一张条件图 (与 generator 列表一一对应)；拼成一个 [B, C, H, W] 张量，
+            # 4D 张量组成的 list 在 VaeImageProcessor.preprocess 中已弃用，每次调用都会警告
+            image=torch.cat([images[i] for i in rows]),
+            num_videos_per_prompt=1,
+            num_inference_steps=NUM_INFERENCE_STEPS,
+            num_frames=NUM_FRAMES,
+            guidance_scale=GUIDANCE_SCALE,
+            generator=batch_generators,
+            output_type="pt",
+        ).frames[:num_videos]
+        # [B, F, C, H, W] 的 [0, 1] 张量在解码设备上直接转成 uint8，只把 1/4 的数据拷回 CPU；
+        # 先转 fp32 再乘 255，避免 bf16 的精度把像素值舍入到错误的整数
+        frames = frames.float().mul_(255).round_().to(torch.uint8).permute(0, 1, 3, 4, 2)
+        return frames.cpu().numpy()
+
+    try:
+        return run(list(range(len(generators))), pad_to=_static_batch_size)
+    except torch.cuda.OutOfMemoryError:
+        if len(generators) == 1 and _static_batch_size in (None, 1):
+            raise
+        print("[WARN] OOM in batched generation, falling back to one video per call.")
+        torch.cuda.empty_cache()
+
+    # 逐个回退时使用未编译的 transformer，避免为 batch=1 再编译一次并录制新的 CUDA Graph
+    transformer = pipe.transformer
+    if _static_batch_size is not None:
+        pipe.transformer = transformer._orig_mod
+    outputs = []
+    try:
+        for i in range(len(generators)):
+            # 失败的批量调用已经推进了 generator 的状态，按原 seed 重新播种，结果与 SEED 保持一致
+            generators[i].manual_seed(generators[i].initial_seed())
+            try:
+                outputs.append(run([i])[0])
+            except Exception as e:
+                print(f"[ERROR] Generation failed: {e}. Skipping this video.")
+                torch.cuda.empty_cache()
+                outputs.append(None)
+    finally:
+        pipe.transformer = transformer
+    return outputs
+
+def write_video(frames: np.ndarray, out_path: str):
+    """
+    把 [F, H, W, 3] 的 uint8 帧作为 rawvideo 一次性写入 ffmpeg 的 stdin，用 libx264 编码为 mp4，
+    省去 export_to_video 逐帧经过 PIL / imageio 的 Python 开销。
+    """
+    num_frames, height, width, _ = frames.shape
+    cmd = [
+        imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-loglevel", "error",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(FPS), "-i", "-",
+        "-c:v", "libx264", "-preset", FFMPEG_PRESET, "-pix_fmt", "yuv420p", out_path,
+    ]
+    # 直接把数组的内存交给 stdin，不再 tobytes() 复制一份 (每个视频约 250 MB)；
+    # cast 成一维字节视图，communicate 按字节偏移切片写入
+    data = memoryview(np.ascontiguousarray(frames)).cast("B")
+    proc = subprocess.run(cmd, input=data, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed for {out_path}: {proc.stderr.decode(errors='replace').strip()}")
+
+def process_batch(pipe, batch: list, device, results, export_pool, pending_exports: list, shard_path: str):
+    """
+    为 batch 中所有 Group 缺失的视频做一次批量生成，并把视频编码提交到后台线程。
+    batch 中每项为 (group_entry, group_folder, missing_videos, image, text_prompt)，处理完后清空。
+    """
+    group_ids = [group_entry["group_id"] for group_entry, *_ in batch]
+    counts = [len(missing_videos) for _, _, missing_videos, _, _ in batch]
+
+    # 按视频展开：每个视频一张条件图、一个独立 seed 的 generator
+    images = [image for _, _, missing_videos, image, _ in batch for _ in missing_videos]
+    generators = get_generators(len(images), device)
+    print(f"[COG] Generating {len(images)} videos in one batch for Groups {group_ids}")
+
+    try:
+        prompt_embeds, negative_prompt_embeds = encode_text_prompt(pipe, [b[4] for b in batch], device)
+        repeats = torch.tensor(counts, device=prompt_embeds.device)
+        prompt_embeds = prompt_embeds.repeat_interleave(repeats, dim=0)
+        if negative_prompt_embeds is not None:
+            negative_prompt_embeds = negative_prompt_embeds.repeat_interleave(repeats, dim=0)
+        outputs = generate_videos(pipe, prompt_embeds, negative_prompt_embeds, images, generators)
+    except Exception as e:
+        print(f"[ERROR] Generation failed for Groups {group_ids}: {e}. Skipping batch.")
+        torch.cuda.empty_cache()
+        outputs = [None] * len(images)
+
+    # 上一个 batch 的视频在本次生成期间已编码完毕，此时再统一记录
+    finish_exports(pending_exports, results, shard_path)
+
+    outputs = iter(outputs)
+    for group_entry, group_folder, missing_videos, _, _ in batch:
+        videos_to_process_count = 0
+        for video_name in missing_videos:
+            output = next(outputs)
+            if output is None:
+                continue
+            out_path = group_folder / video_name
+
+            # 保存视频到磁盘 (后台线程)
+            future = export_pool.submit(write_video, output, str(out_path))
+            pending_exports.append((future, group_entry, video_name))
+            videos_to_process_count += 1
+
+        print(f"[JSON] Finished processing Group {group_entry['group_id']}. {videos_to_process_count} new videos queued for export.")
+
+    # batch cleanup
+    batch.clear()
+    torch.cuda.empty_cache()
+
+def finish_exports(pending: list, results: Dict[int, Dict[str, Any]], shard_path: str):
+    """
+    等待后台 write_video 完成，并把成功保存的视频写入对应的 Group Entry 和结果分片。
+    pending 中每项为 (future, group_entry, video_name)，处理完后清空。
+    结果分片在所有视频记录完之后只追加一次 (每个 Group 一次)。
+    """
+    updated_entries = {}
+    for future, group_entry, video_name in pending:
+        group_id = group_entry["group_id"]
+        try:
+            future.result()
+        except Exception as e:
+            print(f"[ERROR] Saving failed for {video_name}: {e}.")
+            continue
+        print(f"[COG] Saved → {Path(OUTPUT_DIR) / str(group_id) / video_name}")
+
+        # 创建新的视频记录 (不包含 seed)
+        video_path_relative = Path(str(group_id)) / video_name 
+        new_video_entry = {
+            "video_name": video_name,
+            "video_path": str(video_path_relative), 
+        }
+
+        # 更新 Group Entry
+        group_entry["videos"][video_name] = new_video_entry
+        updated_entries[group_id] = group_entry
+
+    pending.clear()
+    if not updated_entries:
+        return
+
+    # 统一写入 JSON
+    results.update(updated_entries)
+    append_results_shard(updated_entries, shard_path)
+
+# --- 单个 worker (一张 GPU) 的主体 ---
+def run_worker(rank: int = 0, world_size: int = 1, config: Optional[Dict[str, Any]] = None):
+    # spawn 出的子进程重新 import 本模块，需要再次应用入口脚本的配置
+    if config:
+        configure(**config)
+    
+    # ⭐ 步骤 1: 设置设备
+    device = torch.device("cpu") # 默认值
+    if world_size > 1 and torch.cuda.is_available():
+        # 多 worker 时忽略 GPU_ID：由本脚本 spawn 时每个 rank 看到全部 GPU，使用 cuda:rank；
+        # 由 Bash 用 CUDA_VISIBLE_DEVICES 隔离时只看到一张卡，即 cuda:0
+        device = torch.device(f"cuda:{rank % torch.cuda.device_count()}")
+        torch.cuda.set_device(device)
+        print(f"[INFO] Worker {rank}/{world_size} using {device}")
+    elif GPU_ID is not None and torch.cuda.is_available():
+        os.environ["CUDA_VISIBLE_DEVICES"] = str(GPU_ID) 
+        device = torch.device("cuda:0")
+        print(f"[INFO] Using CUDA Device ID {GPU_ID}. PyTorch internal ID is cuda:0")
+    elif torch.cuda.is_available():
+        device = torch.device("cuda:0")
+        print("[INFO] Using default CUDA Device ID 0.")
+    else:
+        print("[INFO] CUDA not available. Using CPU.")
+
+    if device.type == 'cuda':
+        # 允许 fp32 matmul 使用 TF32；输入形状固定，让 cuDNN 为 VAE 的 3D 卷积挑选最快的算法
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+        torch.backends.cudnn.benchmark = True
+
+    if SEED is not None:
+        random.seed(SEED + rank)
+
+    ensure_dir(OUTPUT_DIR)
+    
+    # -----------------------------------
+    # Load Prompts and Setup Keys (保持不变)
+    # -----------------------------------
+    if not Path(PROMPT_JSON).exists():
+        raise FileNotFoundError(f"Cannot find {PROMPT_JSON}")
+
+    with open(PROMPT_JSON, 'rb') as f:
+        assignments = json_loads(f.read())
+
+    all_keys = sorted(assignments.keys())
+    keys_to_process = all_keys[:MAX_GROUPS] if MAX_GROUPS is not None else all_keys
+
+    # 交错切分 keys (rank::world_size)，各 worker 负载均衡且互不重叠
+    keys_to_process = keys_to_process[rank::world_size]
+    if world_size > 1:
+        print(f"[INFO] Worker {rank}/{world_size}: {len(keys_to_process)} groups assigned.")
+    
+    # -----------------------------------
+    # 步骤 2: Load CogVideoX 到指定 GPU
+    # -----------------------------------
+    print(f"Loading {MODEL_ID}...")
+    try:
+        pipe = CogVideoXImageToVideoPipeline.from_pretrained(
+            MODEL_ID, 
+            torch_dtype=torch.bfloat16
+        )
+
+        # 使用 trailing 时间步间隔的 DDIM，减少步数时仍覆盖到 t = T 的高噪声端
+        pipe.scheduler = CogVideoXDDIMScheduler.from_config(pipe.scheduler.config, timestep_spacing="trailing")
+
+        pipe.to(device)
+             
+        pipe.vae.enable_tiling()
+        pipe.vae.enable_slicing()
+
+        # CogVideoX 默认的 CogVideoXAttnProcessor2_0 已经走 SDPA (flash / mem-efficient)；
+        # 在此基础上把 Q/K/V 三个投影合并成一次 GEMM
+        pipe.fuse_qkv_projections()
+
+        if QUANTIZE_TRANSFORMER:
+            quantize_transformer(pipe, "int8" if QUANTIZE_TRANSFORMER is True else QUANTIZE_TRANSFORMER)
+
+        if COMPILE_TRANSFORMER and device.type == 'cuda':
+            # 去噪循环中 DiT 的输入形状固定 (帧数固定，图像由 pipeline 缩放到固定 H×W)，
+            # 编译一次后每一步都复用 CUDA Graph，省去大量 kernel launch 开销
+            pipe.transformer = torch.compile(
+                pipe.transformer, mode="reduce-overhead", fullgraph=False, dynamic=False
+            )
+            # 在这里按生产 batch 大小触发编译：失败时立即退回 eager，而不是在每个 batch 里反复编译失败。
+            # 不完整的 batch 补齐到同一大小，OOM 逐个回退时使用 eager transformer，只有一个 CUDA Graph
+            if warmup_compiled_transformer(pipe, device):
+                print("[INFO] Transformer compiled.")
+
+        if DECODE_DEVICE is not None:
+            offload_vae_decode(pipe, DECODE_DEVICE)
+            print(f"[INFO] VAE decode runs on {DECODE_DEVICE}")
+
+        # 放在 offload_vae_decode 之后，解码用的 VAE 拷贝不带这个缓存
+        cache_image_encode(pipe)
+
+    except Exception as e:
+        print(f"[FATAL ERROR] 加载 CogVideoX 失败: {e}")
+        # 打印 OOM 错误详情
+        if 'CUDA out of memory' in str(e):
+             print("[FATAL] OOM during model loading. Check CPU RAM capacity.")
+        sys.exit(1)
+
+
+    # -----------------------------------
+    # Generation Loop (Group Level)
+    # -----------------------------------
+    results = load_results_json()
+    shard_path = results_shard_path(rank)
+
+    # 视频编码 (ffmpeg) 在后台线程中进行，与下一个 Group 的 GPU 生成重叠
+    export_pool = ThreadPoolExecutor(max_workers=2)
+    pending_exports = []
+    # 有缺失视频、待生成的 Group
+    todo = []
+    # 待批量生成的 Group
+    batch = []
+    
+    for idx, key in enumerate(keys_to_process):
+        data = assignments[key]
+        img_path = data["image_prompt"]
+        text_prompt = data["text_prompt"]
+
+        group_id = int(key) 
+        group_folder = Path(OUTPUT_DIR) / str(group_id)
+        ensure_dir(group_folder)
+
+        # 查找或创建 Group Entry (按 group_id O(1) 查找)
+        group_entry = results.get(group_id)
+        if group_entry is None:
+            # 新 Group 在有视频保存成功后才写入 results
+            group_entry = {
+                "group_id": group_id,
+                "image_path": img_path,
+                "text_prompt": text_prompt,
+                "videos": {}
+            }
+            
+        print("\n==============================")
+        print(f"Processing Group {group_id} (key: {key})")
+        print(f"Image:   {img_path}")
+        print(f"Videos recorded so far: {len(group_entry['videos'])}/{K}")
+        print("==============================")
+        
+        # 缓存已记录的且文件存在的视频名
+        recorded_videos = {
+            name for name in group_entry["videos"] if skip(group_folder / name)
+        }
+
+        missing_videos = []
+        for k_idx in range(1, K + 1):
+            video_name = f"{k_idx}.mp4"
+            if video_name in recorded_videos:
+                print(f"[SKIP] {video_name} already exists.")
+            else:
+                missing_videos.append(video_name)
+
+        # 全部 K 个视频都已完成：不读图、不生成，也不重写 JSON
+        if not missing_videos:
+            print(f"[SKIP] Group {group_id} fully done.")
+            continue
+
+        todo.append((group_entry, group_folder, missing_videos, img_path, text_prompt))
+
+    # -----------------------------------
+    # 步骤 3: 攒够 BATCH_GROUPS 个 Group 后，一次 pipe 调用批量生成所有缺失的视频
+    # 后台线程提前读取、缩放并上传下一个 Group 的图像，与当前 Group 的 GPU 生成重叠
+    # -----------------------------------
+    height, width = model_input_size(pipe)
+    # 专用的 H2D 拷贝 stream (CPU 上为 None)
+    copy_stream = torch.cuda.Stream(device) if device.type == 'cuda' else None
+    prefetch_pool = ThreadPoolExecutor(max_workers=1)
+
+    def prefetch(i):
+        if i >= len(todo):
+            return None
+        return prefetch_pool.submit(load_image_tensor, todo[i][3], height, width, device, copy_stream)
+
+    next_image = prefetch(0)
+    for i, (group_entry, group_folder, missing_videos, img_path, text_prompt) in enumerate(todo):
+        # 最多同时持有当前和下一个 Group 的图像
+        image_future, next_image = next_image, prefetch(i + 1)
+        try:
+            image = wait_image_ready(*image_future.result())
+        except Exception as e:
+            print(f"[ERROR] Could not load image {img_path}: {e}")
+            continue
+
+        batch.append((group_entry, group_folder, missing_videos, image, text_prompt))
+        if len(batch) >= BATCH_GROUPS:
+            process_batch(pipe, batch, device, results, export_pool, pending_exports, shard_path)
+
+    # 不足 BATCH_GROUPS 的尾部
+    if batch:
+        process_batch(pipe, batch, device, results, export_pool, pending_exports, shard_path)
+
+    finish_exports(pending_exports, results, shard_path)
+    export_pool.shutdown()
+    prefetch_pool.shutdown()
+
+    print("\n======== ALL DONE ========\n")
+
+
+# --- 主函数 ---
+def main(**config):
+    """命令行入口；config 为入口脚本的配置 (见上方 PATHS & CONFIGURATION)"""
+    configure(**config)
+
+    parser = argparse.ArgumentParser(description=f"CogVideoX I2V batch generation ({MODEL_ID})")
+    parser.add_argument(
+        "--world_size",
+        type=int,
+        default=1,
+        help="Number of workers (one per GPU); worker i processes keys[i::world_size]"
+    )
+    parser.add_argument(
+        "--rank",
+        type=int,
+        default=None,
+        help="Run only this worker (for external launchers such as run_cog_gen.sh); "
+             "if omitted, spawn all --world_size workers in this process"
+    )
+    parser.add_argument(
+        "--merge",
+        action="store_true",
+        help="Only merge the per-worker .rank*.jsonl result shards into the output JSON and exit"
+    )
+    args = parser.parse_args()
+    if args.world_size < 1:
+        parser.error("--world_size must be >= 1")
+    if args.rank is not None and not 0 <= args.rank < args.world_size:
+        parser.error(f"--rank must be in [0, {args.world_size}) for --world_size {args.world_size}")
+    # 本进程 spawn 所有 worker 时每个 rank 需要一张独占的 GPU，否则多个 worker 在同一张卡上各加载一份模型而 OOM。
+    # 指定 --rank 时由外部启动器 (如 run_cog_gen.sh) 用 CUDA_VISIBLE_DEVICES 分配 GPU，每个进程只看到一张卡，不做此检查
+    if args.rank is None and not args.merge and args.world_size > 1 and args.world_size > torch.cuda.device_count():
+        parser.error(f"--world_size {args.world_size} exceeds the {torch.cuda.device_count()} visible GPUs")
+
+    if args.merge:
+        merge_results()
+        return
+
+    if args.rank is not None:
+        run_worker(args.rank, args.world_size)
+        # 其他 worker 可能仍在运行，由外部在全部结束后执行 --merge
+        print(f"[JSON] Worker {args.rank} done. Run with --merge after all workers finish.")
+        return
+
+    if args.world_size > 1:
+        # 每张 GPU 一个独立进程 (独立 CUDA context)，各自加载一份模型
+        torch.multiprocessing.spawn(run_worker, args=(args.world_size, config), nprocs=args.world_size)
+    else:
+        run_worker()
+    merge_results()
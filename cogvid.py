@@ -9,7 +9,8 @@ pipe = CogVideoXImageToVideoPipeline.from_pretrained(
     torch_dtype=torch.bfloat16
 )
 
-pipe.enable_sequential_cpu_offload()
+# 按组件整体 offload (不要在此之前 pipe.to("cuda"))，比逐子模块的 sequential offload 快得多
+pipe.enable_model_cpu_offload()
 pipe.vae.enable_tiling()
 pipe.vae.enable_slicing()
 
@@ -1,12 +1,14 @@
 import torch
 import json
 from pathlib import Path
-from diffusers import CogVideoXImageToVideoPipeline
+import diffusers
+from diffusers import CogVideoXImageToVideoPipeline, AutoencoderKLCogVideoX, CogVideoXTransformer3DModel
 from diffusers.utils import load_image # <--- 引入 load_image
 import random
 import os
 import sys
 import logging
+import argparse
 
 # 配置日志，确保信息输出
 logging.basicConfig(level=logging.INFO, format='%(message)s')
@@ -17,55 +19,79 @@ logging.basicConfig(level=logging.INFO, format='%(message)s')
 MODEL_ID = "THUDM/CogVideoX-5b-I2V"
 # ----------------------------
 
-def inspect_cogvideo_config():
+def inspect_cogvideo_config(run_encode=False, full_load=False):
     # -----------------------------------
-    # 1. 初始化和核心组件检查 (保持不变)
+    # 1. 初始化和核心组件检查
     # -----------------------------------
     logging.info(f"--- 1. 正在加载模型配置: {MODEL_ID} ---")
     pipeline = None
+    vae = None
     
-    try:
-        pipeline = CogVideoXImageToVideoPipeline.from_pretrained(
-            MODEL_ID,
-            torch_dtype=torch.bfloat16
-        )
-    except Exception as e:
-        logging.error(f"[ERROR] 无法加载 Pipeline。错误: {e}")
-        return
-
-    pipeline.to("cpu") 
+    if full_load:
+        # 完整加载所有权重 (~11 GB 内存)，仅在 --full_load 时使用
+        try:
+            pipeline = CogVideoXImageToVideoPipeline.from_pretrained(
+                MODEL_ID,
+                torch_dtype=torch.bfloat16
+            )
+        except Exception as e:
+            logging.error(f"[ERROR] 无法加载 Pipeline。错误: {e}")
+            return
+
+        pipeline.to("cpu") 
+        vae = pipeline.vae
+        vae_config = pipeline.vae.config
+        transformer_config = pipeline.transformer.config
+        scheduler = pipeline.scheduler
+    else:
+        # 默认只读取各组件的 config.json，不实例化任何带权重的 nn.Module
+        try:
+            model_index = CogVideoXImageToVideoPipeline.load_config(MODEL_ID)
+            vae_config = AutoencoderKLCogVideoX.load_config(MODEL_ID, subfolder="vae")
+            transformer_config = CogVideoXTransformer3DModel.load_config(MODEL_ID, subfolder="transformer")
+            # 调度器没有权重，直接实例化即可拿到 alphas_cumprod
+            scheduler_cls = getattr(diffusers, model_index["scheduler"][1])
+            scheduler = scheduler_cls.from_pretrained(MODEL_ID, subfolder="scheduler")
+        except Exception as e:
+            logging.error(f"[ERROR] 无法读取组件配置。错误: {e}")
+            return
     
     logging.info(f"--- 2. 模型核心组件类型与名称 ---")
-    # ... (DIT, VAE, Text Encoder, Image Encoder 检查逻辑保持不变)
-    
-    # Denoising Model (DIT)
-    try:
-        logging.info(f"Denoising Model (DIT): {type(pipeline.transformer).__name__} (属性名: .transformer)")
-    except AttributeError:
-        logging.info("Denoising Model (DIT): ERROR - '.transformer' 属性访问失败。")
+
+    if pipeline is None:
+        # 组件类型直接来自 model_index.json
+        for name, spec in model_index.items():
+            if isinstance(spec, (list, tuple)) and len(spec) == 2 and spec[1] is not None:
+                logging.info(f"{name}: {spec[1]} (属性名: .{name})")
+    else:
+        # Denoising Model (DIT)
+        try:
+            logging.info(f"Denoising Model (DIT): {type(pipeline.transformer).__name__} (属性名: .transformer)")
+        except AttributeError:
+            logging.info("Denoising Model (DIT): ERROR - '.transformer' 属性访问失败。")
         
-    # VAE Encoder/Decoder
-    try:
-        logging.info(f"VAE Encoder/Decoder: {type(pipeline.vae).__name__} (属性名: .vae)")
-    except AttributeError:
-        logging.info("VAE Encoder/Decoder: ERROR - '.vae' 属性访问失败。")
+        # VAE Encoder/Decoder
+        try:
+            logging.info(f"VAE Encoder/Decoder: {type(pipeline.vae).__name__} (属性名: .vae)")
+        except AttributeError:
+            logging.info("VAE Encoder/Decoder: ERROR - '.vae' 属性访问失败。")
 
-    # Text Encoder
-    try:
-        logging.info(f"Text Encoder (T5): {type(pipeline.text_encoder).__name__} (属性名: .text_encoder)")
-    except AttributeError:
-        logging.info("Text Encoder (T5): ERROR - '.text_encoder' 属性访问失败。")
+        # Text Encoder
+        try:
+            logging.info(f"Text Encoder (T5): {type(pipeline.text_encoder).__name__} (属性名: .text_encoder)")
+        except AttributeError:
+            logging.info("Text Encoder (T5): ERROR - '.text_encoder' 属性访问失败。")
         
-    # Image Encoder (I2V 模型的关键)
-    try:
-        if hasattr(pipeline, 'image_encoder') and pipeline.image_encoder is not None:
-             logging.info(f"Image Encoder: {type(pipeline.image_encoder).__name__} (属性名: .image_encoder)")
-        elif hasattr(pipeline, 'feature_extractor') and pipeline.feature_extractor is not None:
-             logging.info(f"Image Encoder: {type(pipeline.feature_extractor).__name__} (属性名: .feature_extractor)")
-        else:
-             logging.info("Image Encoder: (未找到标准属性名)")
-    except AttributeError:
-        logging.info("Image Encoder: (属性检查失败)")
+        # Image Encoder (I2V 模型的关键)
+        try:
+            if hasattr(pipeline, 'image_encoder') and pipeline.image_encoder is not None:
+                 logging.info(f"Image Encoder: {type(pipeline.image_encoder).__name__} (属性名: .image_encoder)")
+            elif hasattr(pipeline, 'feature_extractor') and pipeline.feature_extractor is not None:
+                 logging.info(f"Image Encoder: {type(pipeline.feature_extractor).__name__} (属性名: .feature_extractor)")
+            else:
+                 logging.info("Image Encoder: (未找到标准属性名)")
+        except AttributeError:
+            logging.info("Image Encoder: (属性检查失败)")
         
     logging.info("-" * 60)
 
@@ -76,8 +102,8 @@ def inspect_cogvideo_config():
     
     # 尝试访问 VAE 配置中的样本尺寸 (如果存在)
     try:
-        if hasattr(pipeline.vae, 'config') and 'sample_size' in pipeline.vae.config:
-            vae_size = pipeline.vae.config.sample_size
+        if 'sample_size' in vae_config:
+            vae_size = vae_config['sample_size']
             logging.info(f"VAE Latent Sample Size (H', W'): {vae_size} x {vae_size}")
     except Exception:
         pass
@@ -101,53 +127,82 @@ def inspect_cogvideo_config():
                  
         except Exception:
             logging.warning("[WARN] 无法从 image_processor config 中解析尺寸。")
+    else:
+        logging.info("Image Processor: 在 pipeline 初始化时构建，不在磁盘配置中 (使用 --full_load 查看)")
 
     # ------------------------------------------------
-    # 模拟 VAE 编码步骤来确认像素张量形状
+    # 根据 VAE 配置推算潜变量形状 (不分配张量、不跑前向)
     # ------------------------------------------------
-    logging.info(f"--- 6. 模拟 VAE 编码输入以确认形状 ---")
-    
-    # ⚠️ 关键步骤：创建一个伪造的输入张量，模拟加载的视频帧
-    # VAE 期望 [B, C, F, H, W] 形状的张量 (通常是 float32 或 float16/bfloat16)
+    logging.info(f"--- 6. 根据 VAE 配置推算潜变量形状 ---")
     
     # 我们使用一个保守的尺寸占位符 (例如 768x1280)，你可能需要修正
     H_PXL, W_PXL = 768, 1280 
     F = 81 # 帧数
-    
-    # 伪造一个视频输入张量 (Batch=1, Channels=3)
-    dummy_video_tensor = torch.randn(1, 3, F, H_PXL, W_PXL, dtype=torch.bfloat16)
-    
-    try:
-        logging.info(f"尝试使用 {dummy_video_tensor.shape} 张量运行 VAE Encoder...")
-        
-        with torch.no_grad():
-            dummy_video_tensor = dummy_video_tensor.to(pipeline.vae.dtype) # 匹配 VAE 的 dtype
-            
-            # 运行 VAE 编码
-            latent_dist = pipeline.vae.encode(dummy_video_tensor).latent_dist
-            
-            # 潜在变量的形状
-            latent_sample_shape = latent_dist.sample().shape 
-            
-            logging.info(f"[VAE Latent Output Shape]: {latent_sample_shape}")
-            logging.info(f"[推测的 VAE 输入 Pixel H, W]: {H_PXL}, {W_PXL} (基于假设)")
-            
-    except RuntimeError as e:
-        # 如果尺寸不匹配，VAE 会抛出运行时错误
-        if "size mismatch" in str(e) or "Input size" in str(e):
-             logging.error(f"[ERROR] VAE 输入尺寸不匹配。请根据错误信息修正 H_PXL/W_PXL。")
-             logging.error(f"  原始错误: {e}")
-        else:
-             logging.error(f"[ERROR] VAE 编码失败: {e}")
-             
-    except Exception as e:
-        logging.error(f"[ERROR] VAE 编码检查失败: {e}")
+
+    # 与 diffusers CogVideoX pipeline 的 vae_scale_factor_spatial / temporal 计算方式一致
+    s_ratio = 2 ** (len(vae_config['block_out_channels']) - 1)
+    t_ratio = vae_config.get('temporal_compression_ratio', 4)
+    latent_channels = vae_config['latent_channels']
+
+    latent_shape = (1, latent_channels, (F - 1) // t_ratio + 1, H_PXL // s_ratio, W_PXL // s_ratio)
+    logging.info(f"空间压缩比: {s_ratio}, 时间压缩比: {t_ratio}, 潜变量通道数: {latent_channels}")
+    logging.info(f"[推算的 VAE Latent Shape]: {latent_shape} (输入 Pixel H, W = {H_PXL}, {W_PXL}, F = {F})")
+
+    if run_encode:
+        # ------------------------------------------------
+        # 模拟 VAE 编码步骤来确认像素张量形状 (需 --run_encode，耗时且占用数 GB 内存)
+        # ------------------------------------------------
+        logging.info(f"--- 6b. 模拟 VAE 编码输入以确认形状 ---")
+
+        # ⚠️ 关键步骤：创建一个伪造的输入张量，模拟加载的视频帧
+        # VAE 期望 [B, C, F, H, W] 形状的张量 (通常是 float32 或 float16/bfloat16)
+
+        # 伪造一个视频输入张量 (Batch=1, Channels=3)
+        dummy_video_tensor = torch.randn(1, 3, F, H_PXL, W_PXL, dtype=torch.bfloat16)
+
+        try:
+            if vae is None:
+                # 只加载 VAE 这一个组件
+                vae = AutoencoderKLCogVideoX.from_pretrained(
+                    MODEL_ID,
+                    subfolder="vae",
+                    torch_dtype=torch.bfloat16,
+                    low_cpu_mem_usage=True
+                )
+
+            # 分块 / 分片编码，限制 dummy 输入的峰值激活内存
+            vae.enable_tiling()
+            vae.enable_slicing()
+
+            logging.info(f"尝试使用 {dummy_video_tensor.shape} 张量运行 VAE Encoder...")
+
+            with torch.inference_mode():
+                dummy_video_tensor = dummy_video_tensor.to(vae.dtype) # 匹配 VAE 的 dtype
+
+                # 运行 VAE 编码
+                latent_dist = vae.encode(dummy_video_tensor).latent_dist
+
+                # 潜在变量的形状
+                latent_sample_shape = latent_dist.sample().shape 
+
+                logging.info(f"[VAE Latent Output Shape]: {latent_sample_shape}")
+                logging.info(f"[推测的 VAE 输入 Pixel H, W]: {H_PXL}, {W_PXL} (基于假设)")
+
+        except RuntimeError as e:
+            # 如果尺寸不匹配，VAE 会抛出运行时错误
+            if "size mismatch" in str(e) or "Input size" in str(e):
+                 logging.error(f"[ERROR] VAE 输入尺寸不匹配。请根据错误信息修正 H_PXL/W_PXL。")
+                 logging.error(f"  原始错误: {e}")
+            else:
+                 logging.error(f"[ERROR] VAE 编码失败: {e}")
+
+        except Exception as e:
+            logging.error(f"[ERROR] VAE 编码检查失败: {e}")
         
     logging.info("-" * 60)
 
     # ... (SCHEDULER 和 DIT 检查逻辑保持不变)
     logging.info(f"--- 3. SCHEDULER (调度器) 配置 ---")
-    scheduler = pipeline.scheduler
     logging.info(f"Scheduler Type: {type(scheduler).__name__}")
     if hasattr(scheduler, 'config'):
         logging.info("\n[Scheduler Config (JSON)]: ")
@@ -161,8 +216,8 @@ def inspect_cogvideo_config():
     
     logging.info(f"--- 4. DIT 模型配置 (用于 LoRA) ---")
     try:
-        if hasattr(pipeline.transformer, 'config'):
-            dit_config = pipeline.transformer.config
+        if transformer_config is not None:
+            dit_config = transformer_config
             logging.info(f"  Hidden Size / Embed Dim: {dit_config.get('hidden_size')}")
             logging.info(f"  Cross-Attention Dim: {dit_config.get('cross_attention_dim')}")
             logging.info(f"  Timestep/Frame Count: {dit_config.get('num_frames')}") 
@@ -171,13 +226,28 @@ def inspect_cogvideo_config():
         
     logging.info("---------------------------------------------------\n")
 
-    # 显式删除 pipeline 以释放内存
+    # 显式删除 pipeline / VAE 以释放内存
     if pipeline:
         del pipeline
+    if vae is not None:
+        del vae
     
     # 正常退出
     sys.exit(0) 
 
 
 if __name__ == "__main__":
-    inspect_cogvideo_config()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Inspect CogVideoX I2V pipeline config")
+    parser.add_argument(
+        "--run_encode",
+        action="store_true",
+        help="Also run a real VAE encode on a dummy video to validate the latent shape (slow, several GB RAM)"
+    )
+    parser.add_argument(
+        "--full_load",
+        action="store_true",
+        help="Load the full pipeline weights (~11 GB RAM) instead of only reading the component config files"
+    )
+    args = parser.parse_args()
+
+    inspect_cogvideo_config(run_encode=args.run_encode, full_load=args.full_load)
\ No newline at end of file
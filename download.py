@@ -23,6 +23,7 @@ import traceback
 import shutil
 import urllib.request
 import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from huggingface_hub import HfFileSystem
 
 api = HfApi()
@@ -166,43 +167,70 @@ def get_download_list(subset_opt: str, hash_name: str, reso_opt: str, file_type:
     return ret
 
 
-def download(download_list: list, output_dir: str, is_clean_cache: bool):
+def download_item(item: dict, output_dir: str, is_clean_cache: bool):
+    """ Download (and unzip) a single item of the download list.
+
+    :param item: the file to download, {'repo', 'rel_path'}
+    :param output_dir: the output directory 
+    :param is_clean_cache: if set, will clean the huggingface cache after the download 
+    :return: True if the file exists locally or was downloaded successfully, False otherwise
+    """
+    repo = item['repo']
+    rel_path = item['rel_path']
+
+    output_path = os.path.join(output_dir, rel_path)
+    output_path = output_path.replace('.zip', '')
+    # skip if already exists locally
+    if os.path.exists(output_path):
+        return True
+    succ = hf_download_path(repo, rel_path, output_dir)
+
+
+    if succ:
+        if is_clean_cache:
+            clean_huggingface_cache(output_dir, repo)
+        
+        # unzip the file 
+        if rel_path.endswith('.zip'):
+            zip_file = join(output_dir, rel_path)
+            with zipfile.ZipFile(zip_file, 'r') as zip_ref:
+                ofile = join(output_dir, os.path.dirname(rel_path))
+                zip_ref.extractall(ofile)
+            os.remove(zip_file)
+    else:
+        print(f'Download {rel_path} failed')
+    return succ
+
+
+def download(download_list: list, output_dir: str, is_clean_cache: bool, max_workers: int = 1):
     """ Download the dataset based on the download_list and user options.
 
+        With max_workers > 1 the files are fetched concurrently by a thread pool (the work is network bound). 
+        The cache directory is shared by all workers, so in that case it is cleaned once at the end. 
+
     :param download_list: the list of files to download, [{'repo', 'rel_path'}]
     :param output_dir: the output directory 
     :param reso_opt: the resolution option 
     :param is_clean_cache: if set, will clean the huggingface cache to save space 
+    :param max_workers: the number of concurrent downloads 
     """	
-    succ_count = 0
-    
-    for item in tqdm(download_list, desc='Downloading'):
-        repo = item['repo']
-        rel_path = item['rel_path']
-        
-        output_path = os.path.join(output_dir, rel_path)
-        output_path = output_path.replace('.zip', '')
-        # skip if already exists locally
-        if os.path.exists(output_path):
-            succ_count += 1
-            continue
-        succ = hf_download_path(repo, rel_path, output_dir)
-
-
-        if succ:
-            succ_count += 1
-            if is_clean_cache:
-                clean_huggingface_cache(output_dir, repo)
-            
-            # unzip the file 
-            if rel_path.endswith('.zip'):
-                zip_file = join(output_dir, rel_path)
-                with zipfile.ZipFile(zip_file, 'r') as zip_ref:
-                    ofile = join(output_dir, os.path.dirname(rel_path))
-                    zip_ref.extractall(ofile)
-                os.remove(zip_file)
-        else:
-            print(f'Download {rel_path} failed')
+    if max_workers <= 1:
+        succ_count = sum(download_item(item, output_dir, is_clean_cache) 
+                         for item in tqdm(download_list, desc='Downloading'))
+    else:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures = [executor.submit(download_item, item, output_dir, False) for item in download_list]
+        try:
+            succ_count = sum(future.result() 
+                             for future in tqdm(as_completed(futures), total=len(futures), desc='Downloading'))
+        except KeyboardInterrupt:
+            # Ctrl-C arrives in the main thread: drop the queued downloads instead of waiting for all of them
+            print('Keyboard Interrupt. Cancelling pending downloads.')
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown()
+        if is_clean_cache and download_list:
+            clean_huggingface_cache(output_dir, download_list[0]['repo'])
 
     print(f'Summary: {succ_count}/{len(download_list)} files downloaded successfully')
     return succ_count == len(download_list)
@@ -220,11 +248,12 @@ def download_dataset(args):
     hash_name  = args.hash
     file_type  = args.file_type
     is_clean_cache = args.clean_cache
+    max_workers = args.max_workers
 
     os.makedirs(output_dir, exist_ok=True)
 
     download_list = get_download_list(subset_opt, hash_name, reso_opt, file_type, output_dir)
-    return download(download_list, output_dir, is_clean_cache)
+    return download(download_list, output_dir, is_clean_cache, max_workers)
 
 
 if __name__ == '__main__':
@@ -234,7 +263,11 @@ if __name__ == '__main__':
     parser.add_argument('--resolution', choices=['4K', '2K', '960P', '480P'], help='The resolution to donwnload', required=True)
     parser.add_argument('--file_type', choices=['images+poses', 'video', 'colmap_cache'], help='The file type to download', required=True, default='images+poses')
     parser.add_argument('--hash', type=str, help='If set subset=hash, this is the hash code of the scene to download', default='')
-    parser.add_argument('--clean_cache', action='store_true', help='If set, will clean the huggingface cache to save space')
+    parser.add_argument('--clean_cache', action='store_true', 
+                        help='If set, will clean the huggingface cache to save space. '
+                             'With --max_workers > 1 the cache is only cleaned once after all downloads finish; '
+                             'use --max_workers 1 to clean it after every file')
+    parser.add_argument('--max_workers', type=int, default=4, help='Number of files to download concurrently')
     params = parser.parse_args()
 
     assert params.file_type in ['images+poses', 'video', 'colmap_cache'], 'Check the file_type input.'
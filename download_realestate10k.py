@@ -4,11 +4,13 @@ Download RealEstate10K dataset videos from YouTube
 Based on: https://github.com/cashiwamochi/RealEstate10K_Downloader
 """
 import os
+import shutil
 import subprocess
 from pathlib import Path
 import requests
 import tarfile
 import argparse
+import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 
@@ -17,6 +19,10 @@ METADATA_URL = "https://storage.cloud.google.com/realestate10k-public-files/Real
 OUTPUT_DIR = "/home/junjie/i2v/datasets/realestate10k"
 VIDEO_DIR = os.path.join(OUTPUT_DIR, "videos")
 METADATA_DIR = os.path.join(OUTPUT_DIR, "metadata")
+VIDEO_FORMAT = "bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]/best[height<=720][ext=mp4]/best"
+
+# One YoutubeDL instance per download thread (the object is not thread-safe)
+_thread_local = threading.local()
 
 def download_metadata():
     """Download and extract RealEstate10K metadata (camera poses)"""
@@ -29,24 +35,37 @@ def download_metadata():
 
     if not os.path.exists(tar_path):
         response = requests.get(METADATA_URL, stream=True)
+        response.raw.decode_content = True
         total_size = int(response.headers.get('content-length', 0))
 
-        with open(tar_path, 'wb') as f, tqdm(
+        # Copy the raw stream in 1 MiB blocks; tqdm only wraps read() for progress
+        with open(tar_path, 'wb') as f, tqdm.wrapattr(
+            response.raw, "read",
             desc="Downloading metadata",
-            total=total_size,
-            unit='B',
-            unit_scale=True
-        ) as pbar:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-                pbar.update(len(chunk))
+            total=total_size
+        ) as raw:
+            shutil.copyfileobj(raw, f, length=1 << 20)
 
         print(f"✓ Downloaded to {tar_path}")
 
-    # Extract
+    # Extract (skip if already unpacked)
+    if os.path.exists(os.path.join(METADATA_DIR, "train")):
+        print(f"✓ Metadata already extracted in {METADATA_DIR}")
+        return METADATA_DIR
+
     print("Extracting metadata...")
-    with tarfile.open(tar_path, 'r:gz') as tar:
-        tar.extractall(METADATA_DIR)
+    if shutil.which("pigz"):
+        # gzip decoding is the bottleneck; pigz decompresses with multiple threads
+        subprocess.run(
+            ["tar", "--use-compress-program=pigz", "-xf", tar_path, "-C", METADATA_DIR],
+            check=True
+        )
+    else:
+        with tarfile.open(tar_path, 'r:gz') as tar:
+            if hasattr(tarfile, "data_filter"):
+                tar.extractall(METADATA_DIR, filter='data')
+            else:
+                tar.extractall(METADATA_DIR)
 
     print(f"✓ Extracted to {METADATA_DIR}")
     return METADATA_DIR
@@ -56,30 +75,39 @@ def parse_video_id(txt_file):
     # Format: <youtube_id>.txt
     return Path(txt_file).stem
 
-def download_youtube_video(video_id, output_path):
+def get_youtube_dl():
+    """Return this thread's YoutubeDL instance, creating it on first use"""
+    ydl = getattr(_thread_local, "ydl", None)
+    if ydl is None:
+        # Imported lazily: yt-dlp may only be installed by --install_deps
+        from yt_dlp import YoutubeDL
+
+        ydl = YoutubeDL({
+            "format": VIDEO_FORMAT,
+            # Same target as before: <VIDEO_DIR>/<video_id>.mp4
+            "outtmpl": os.path.join(VIDEO_DIR, "%(id)s.mp4"),
+            "quiet": True,
+            "no_warnings": True,
+            "noprogress": True,
+        })
+        _thread_local.ydl = ydl
+    return ydl
+
+def download_youtube_video(video_id):
     """
-    Download a single YouTube video using yt-dlp
+    Download a single YouTube video to VIDEO_DIR/<video_id>.mp4 using yt-dlp
+
+    Runs in-process and reuses the calling thread's YoutubeDL instance, so
+    no interpreter/import startup is paid per video.
 
     Args:
         video_id: YouTube video ID
-        output_path: Where to save the video
     """
     try:
-        # Use yt-dlp (better than youtube-dl)
-        cmd = [
-            "yt-dlp",
-            "-f", "bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]/best[height<=720][ext=mp4]/best",
-            "-o", output_path,
-            f"https://www.youtube.com/watch?v={video_id}",
-            "--no-warnings",
-            "--quiet"
-        ]
-
-        subprocess.run(cmd, check=True, capture_output=True)
-        return True, video_id
-
-    except subprocess.CalledProcessError as e:
-        return False, video_id
+        ydl = get_youtube_dl()
+        retcode = ydl.download([f"https://www.youtube.com/watch?v={video_id}"])
+        return retcode == 0, video_id
+
     except Exception as e:
         return False, video_id
 
@@ -122,7 +150,7 @@ def download_videos(num_videos=100, split="train", max_workers=4):
                 successful += 1
                 continue
 
-            future = executor.submit(download_youtube_video, video_id, output_path)
+            future = executor.submit(download_youtube_video, video_id)
             futures[future] = video_id
 
         # Progress bar
@@ -4,11 +4,20 @@
 从 DL3DV 的图像序列结构中，递归查找第一帧 (frame_00001.png)，并保存到输出目录。
 """
 import os
+import json
+import shutil
 import cv2
 from pathlib import Path
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
-from typing import Optional
+from typing import Optional, Tuple
+
+# 可选依赖：PyTurboJPEG (libjpeg-turbo, SIMD 加速的 JPEG 编码)，未安装时退回 cv2.imwrite
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJSAMP_420
+except ImportError:
+    TurboJPEG = None
 
 # ============================================================================
 # ⭐ 配置区域
@@ -19,96 +28,226 @@ DL3DV_DIR = "DL3DV-10K/1K"
 # 输出目录（相对于运行脚本的当前目录）
 OUTPUT_DIR = "../dataset/first_frames"
 
+# 输出方式：jpeg 重新编码为 .jpg；hardlink / symlink 直接链接原始 PNG (不做任何编解码)
+COPY_MODES = ("jpeg", "hardlink", "symlink")
+# 输出目录中视为“帧”的文件后缀
+FRAME_EXTS = (".jpg", ".png")
+# 断点续传记录 (场景第一帧 → 帧编号)，保存在输出目录中
+FRAME_INDEX_FILE = "frame_index.json"
+# JPEG 编码参数只构建一次，避免每帧重新分配列表
+_JPEG_QUALITY = 95
+_JPEG_PARAMS = [int(cv2.IMWRITE_JPEG_QUALITY), _JPEG_QUALITY]
+# 每个工作进程各自懒加载一个 TurboJPEG 实例 (False 表示不可用)
+_turbojpeg = None
+
 # ============================================================================
 # 辅助函数
 # ============================================================================
 
-def get_next_frame_number(output_dir: Path) -> int:
-    """获取基于现有文件的下一个可用帧编号"""
-    existing_frames = list(output_dir.glob("*.jpg"))
-    if not existing_frames:
-        return 0
-
-    numbers = []
-    for frame in existing_frames:
-        try:
-            num = int(frame.stem)
-            numbers.append(num)
-        except ValueError:
+def scan_frame_dir(output_dir: Path, clear: bool = False) -> Tuple[int, int]:
+    """
+    单次 scandir 同时完成：求下一个可用帧编号、统计现有帧数，以及 (可选) 清空现有帧。
+
+    返回 (next_number, total_frames)；clear=True 时删除所有帧并返回 (0, 0)。
+    """
+    best = -1
+    total = 0
+    with os.scandir(output_dir) as it:
+        for entry in it:
+            name = entry.name
+            if not name.endswith(FRAME_EXTS):
+                continue
+            if clear:
+                os.unlink(entry.path)
+                continue
+
+            total += 1
+            stem = name[:-4]
+            # 先用 isdigit 过滤，避免非数字文件名走 int() 的异常路径
+            if stem.isdigit():
+                number = int(stem)
+                if number > best:
+                    best = number
+
+    return best + 1, total
+
+def load_frame_index(output_dir: str) -> dict:
+    """读取输出目录中的编号记录 {相对 DL3DV_DIR 的源路径: 帧编号}，不存在则返回空 dict"""
+    index_path = os.path.join(output_dir, FRAME_INDEX_FILE)
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path) as f:
+        return json.load(f)
+
+def save_frame_index(output_dir: str, frame_index: dict):
+    """原子地写回编号记录"""
+    index_path = os.path.join(output_dir, FRAME_INDEX_FILE)
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(frame_index, f)
+    os.replace(tmp_path, index_path)
+
+def get_turbojpeg():
+    """返回当前进程的 TurboJPEG 实例；未安装或找不到 libturbojpeg 时返回 None"""
+    global _turbojpeg
+    if _turbojpeg is None:
+        _turbojpeg = False
+        if TurboJPEG is not None:
+            try:
+                _turbojpeg = TurboJPEG()
+            except (OSError, RuntimeError) as e:
+                print(f"[WARN] TurboJPEG unavailable, falling back to cv2.imwrite: {e}")
+    return _turbojpeg or None
+
+def find_first_frames(root: str, frame_name: str = "frame_00001.png", max_depth: int = 3) -> list:
+    """
+    在有限深度内查找每个场景的第一帧，避免对整棵目录树做 rglob。
+
+    DL3DV 的结构为 <root>/<scene>/<images_x>/frame_00001.png，因此每个目录只需直接拼接
+    已知文件名检查一次；命中后不再展开该目录，也就不会去列举其中成千上万的图像帧。
+    """
+    found = []
+    stack = [(root, 0)]
+    while stack:
+        path, depth = stack.pop()
+
+        candidate = os.path.join(path, frame_name)
+        if depth > 0 and os.path.isfile(candidate):
+            found.append(candidate)
+            continue
+        if depth >= max_depth:
             continue
 
-    return max(numbers) + 1 if numbers else 0
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, depth + 1))
+    return found
+
+def convert_first_frame(task: Tuple[str, str, str]) -> Tuple[str, bool]:
+    """
+    按 copy_mode 把单个场景的第一帧写到输出路径。放在模块顶层以便被进程池 pickle。
+
+    返回 (image_path, ok)。
+    """
+    image_path, output_path, copy_mode = task
+    try:
+        if copy_mode == "hardlink":
+            try:
+                os.link(image_path, output_path)
+            except OSError:
+                # 跨文件系统无法硬链接时退回普通拷贝 (仍然不做编解码)
+                shutil.copyfile(image_path, output_path)
+        elif copy_mode == "symlink":
+            os.symlink(os.path.abspath(image_path), output_path)
+        else:
+            # 使用 cv2 读取 PNG 图像 (cv2.imread 可以正确处理 PNG 透明度)
+            frame = cv2.imread(image_path)
+
+            if frame is None:
+                 raise ValueError(f"Failed to read image.")
+
+            # 统一保存为 JPEG 格式 (优先使用 libjpeg-turbo；与 cv2 默认一致使用 4:2:0 采样)
+            jpeg = get_turbojpeg()
+            if jpeg is not None:
+                with open(output_path, "wb") as f:
+                    f.write(jpeg.encode(
+                        frame, quality=_JPEG_QUALITY, pixel_format=TJPF_BGR, jpeg_subsample=TJSAMP_420
+                    ))
+            else:
+                cv2.imwrite(output_path, frame, _JPEG_PARAMS)
+        return image_path, True
+
+    except Exception as e:
+        scene_name = os.path.basename(os.path.dirname(image_path))
+        print(f"  ✗ Error processing scene {scene_name} ({os.path.basename(image_path)}): {e}")
+        return image_path, False
 
 # ============================================================================
 # ✨ 核心处理函数：处理 DL3DV 图像序列
 # ============================================================================
 
-def process_dl3dv_images(start_number: int = 0, max_videos: Optional[int] = None) -> int:
+def process_dl3dv_images(
+    start_number: int = 0,
+    max_videos: Optional[int] = None,
+    num_workers: Optional[int] = None,
+    copy_mode: str = "jpeg",
+) -> Tuple[int, int]:
     """
-    递归查找 DL3DV 场景下的第一帧 (frame_00001.png)，并复制到输出目录。
+    递归查找 DL3DV 场景下的第一帧 (frame_00001.png)，并用进程池并行复制到输出目录。
+
+    返回 (highest_written, frames_written)；highest_written 为本次实际写出的最大帧编号，没有写出任何帧时为 -1。
     """
     print("\n=== Processing DL3DV First Frames (frame_00001.png) ===")
     
-    dl3dv_path = Path(DL3DV_DIR)
-    if not dl3dv_path.exists():
+    if not os.path.isdir(DL3DV_DIR):
         print(f"✗ DL3DV directory not found: {DL3DV_DIR}")
-        return start_number
+        return -1, 0
 
-    # 1. 查找所有场景目录下的第一帧图像文件
-    first_frame_paths = list(dl3dv_path.rglob("frame_00001.png"))
+    # 1. 查找所有场景目录下的第一帧图像文件 (有限深度 scandir，不做 rglob)
+    first_frame_paths = find_first_frames(DL3DV_DIR)
 
     # 按场景路径排序，以保证处理顺序一致性
-    first_frame_paths = sorted(first_frame_paths, key=lambda p: str(p.parent))
+    first_frame_paths = sorted(first_frame_paths, key=os.path.dirname)
 
     if not first_frame_paths:
         print(f"✗ No first frame images (frame_00001.png) found in {DL3DV_DIR}")
         print("请检查 DL3DV_DIR 是否设置正确，且子目录中存在 frame_00001.png 文件。")
-        return start_number
+        return -1, 0
 
     # 2. 实现断点续传（Resume Logic）
-    files_to_process = first_frame_paths
-    
-    # 如果 current_number > 0，则跳过前面已处理的文件。
-    if start_number > 0 and start_number < len(first_frame_paths):
-        # 假设文件是按序保存的，我们跳过前 start_number 个文件
-        files_to_process = first_frame_paths[start_number:]
-        print(f"Resume Mode: Skipping {start_number} already processed files.")
-    elif start_number >= len(first_frame_paths):
+    # 每个场景的帧编号记录在 frame_index.json 中，一旦分配就不再改变，
+    # 这样即使中途有失败或中断，重跑时编号也保持稳定。
+    frame_index = load_frame_index(OUTPUT_DIR)
+    if not frame_index and start_number > 0:
+        # 旧的输出目录没有编号记录：沿用“按排序第 i 个文件即第 i 帧”的假设
+        frame_index = {
+            os.path.relpath(p, DL3DV_DIR): i for i, p in enumerate(first_frame_paths[:start_number])
+        }
+
+    next_number = max(start_number, max(frame_index.values(), default=-1) + 1)
+    for image_path in first_frame_paths:
+        key = os.path.relpath(image_path, DL3DV_DIR)
+        if key not in frame_index:
+            frame_index[key] = next_number
+            next_number += 1
+    save_frame_index(OUTPUT_DIR, frame_index)
+
+    # 3. 跳过输出已存在的帧 (不再重复解码)，限制数量并复制文件
+    suffix = ".jpg" if copy_mode == "jpeg" else ".png"
+    tasks = []
+    skipped = 0
+    for image_path in first_frame_paths:
+        output_stem = os.path.join(OUTPUT_DIR, str(frame_index[os.path.relpath(image_path, DL3DV_DIR)]))
+        if any(os.path.lexists(output_stem + ext) for ext in FRAME_EXTS):
+            skipped += 1
+            continue
+        tasks.append((image_path, output_stem + suffix, copy_mode))
+
+    if skipped:
+        print(f"Resume Mode: Skipping {skipped} already processed files.")
+    if not tasks:
         print("Resume Mode: All files appear to be processed.")
-        return start_number
+        return -1, 0
 
-    # 3. 限制数量并复制文件
     if max_videos:
-        files_to_process = files_to_process[:max_videos]
+        tasks = tasks[:max_videos]
 
-    print(f"Found {len(first_frame_paths)} total frames. Processing {len(files_to_process)} frames.")
+    print(f"Found {len(first_frame_paths)} total frames. Processing {len(tasks)} frames.")
 
-    current_number = start_number
     successful = 0
-    
-    for image_path in tqdm(files_to_process, desc="Copying DL3DV first frames"):
-        # 统一保存为 .jpg 格式
-        output_path = Path(OUTPUT_DIR) / f"{current_number}.jpg"
+    # frame_index 会为所有场景预留编号 (包括超出 max_videos 的)，这里只统计实际写出的编号
+    highest_written = -1
 
-        try:
-            # 使用 cv2 读取 PNG 图像 (cv2.imread 可以正确处理 PNG 透明度)
-            frame = cv2.imread(str(image_path))
-            
-            if frame is None:
-                 raise ValueError(f"Failed to read image.")
-                 
-            # 统一保存为 JPEG 格式
-            cv2.imwrite(str(output_path), frame, [cv2.IMWRITE_JPEG_QUALITY, 95])
-            
-            successful += 1
-            current_number += 1
-
-        except Exception as e:
-            print(f"  ✗ Error processing scene {image_path.parent.name} ({image_path.name}): {e}")
-            continue
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        results = executor.map(convert_first_frame, tasks, chunksize=16)
+        for image_path, ok in tqdm(results, total=len(tasks), desc="Copying DL3DV first frames"):
+            if ok:
+                successful += 1
+                highest_written = max(highest_written, frame_index[os.path.relpath(image_path, DL3DV_DIR)])
 
     print(f"✓ DL3DV: Copied {successful} frames")
-    return current_number
+    return highest_written, successful
 
 # ============================================================================
 # 主函数
@@ -138,6 +277,18 @@ def main():
         default=OUTPUT_DIR,
         help=f"Output directory for first frames (default: {OUTPUT_DIR})"
     )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of worker processes used to convert frames"
+    )
+    parser.add_argument(
+        "--copy_mode",
+        choices=COPY_MODES,
+        default="jpeg",
+        help="jpeg: re-encode to .jpg; hardlink/symlink: link the original .png without re-encoding"
+    )
 
     args = parser.parse_args()
 
@@ -151,27 +302,30 @@ def main():
     # 清除现有帧
     if args.clear_existing:
         print(f"Clearing existing frames in {OUTPUT_DIR}...")
-        for frame in output_path.glob("*.jpg"):
-            frame.unlink()
+        current_number, existing_frames = scan_frame_dir(output_path, clear=True)
+        (output_path / FRAME_INDEX_FILE).unlink(missing_ok=True)
         print("✓ Cleared existing frames")
-        current_number = 0
     else:
-        # 获取下一个可用编号
-        current_number = get_next_frame_number(output_path)
+        # 获取下一个可用编号 (同一次扫描顺便统计现有帧数)
+        current_number, existing_frames = scan_frame_dir(output_path)
         print(f"Starting from frame number: {current_number}")
 
     # 执行处理
-    final_number = process_dl3dv_images(
+    highest_written, frames_written = process_dl3dv_images(
         start_number=current_number,
-        max_videos=args.max_videos_per_dataset
+        max_videos=args.max_videos_per_dataset,
+        num_workers=args.num_workers,
+        copy_mode=args.copy_mode
     )
 
-    # 总结
-    total_frames = len(list(output_path.glob("*.jpg")))
+    # 总结 (用计数代替再扫描一遍输出目录)
+    total_frames = existing_frames + frames_written
+    # 输出目录中的最大帧编号 (已有帧或本次写出的帧)
+    highest_number = max(current_number - 1, highest_written)
     print(f"\n{'='*50}")
     print(f"✓ Extraction complete!")
     print(f"✓ Total frames in {OUTPUT_DIR}: {total_frames}")
-    print(f"✓ Frame numbers: 0 to {final_number - 1}")
+    print(f"✓ Frame numbers: 0 to {highest_number}")
     print(f"{'='*50}\n")
 
 if __name__ == "__main__":
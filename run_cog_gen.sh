@@ -49,7 +49,9 @@ for i in "${!GPU_LIST[@]}"; do
     
     # 核心运行命令：利用 CUDA_VISIBLE_DEVICES 隔离 GPU。
     # Python 脚本在每个进程中只会看到并使用这一个 GPU (作为 cuda:0)。
+    # --rank / --world_size：每个 Worker 只处理 keys[i::NUM_GPUS]，互不重复。
     CUDA_VISIBLE_DEVICES=$gpu_id nohup python i2v_cogx.py \
+        --rank $i --world_size $NUM_GPUS \
         > logs/worker_gpu${gpu_id}.log 2>&1 &
         
 done
@@ -57,4 +59,5 @@ done
 echo "====================================================="
 echo "✅ All jobs launched! Monitor logs in $PROJECT_DIR/logs/"
 echo "   To check status: jobs"
+echo "   After all workers finish, merge results: python i2v_cogx.py --merge"
 echo "====================================================="
\ No newline at end of file